@@ -0,0 +1,166 @@
+"""Claves de API del proxy y limitación de tasa por clave.
+
+Las claves se guardan solo como SHA-256 y se buscan con un acceso a dict por
+el digest de la clave recibida. Lo que tarde la comparación depende solo de
+ese digest, que no revela nada de la clave (hacerla coincidir exige una
+preimagen), así que no hace falta `hmac.compare_digest`.
+Para obtener el hash de una clave:  python auth.py <clave>
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+import hashlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin buckets compartidos entre procesos
+    fcntl = None
+
+# Estado de un bucket compartido: tokens disponibles y última recarga (monotonic).
+SLOT = struct.Struct("<dd")
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def hash_api_key(key):
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+def shared_run_id(digests):
+    """Identifica el arranque de la máquina y el orden de las claves (cabecera del archivo compartido)."""
+    try:
+        with open(BOOT_ID_PATH, "rb") as f:
+            boot_id = f.read()
+    except OSError:
+        boot_id = b""
+    return hashlib.blake2b(boot_id + b"".join(digests), digest_size=SLOT.size).digest()
+
+
+def take_token(tokens, updated, now, rate, burst):
+    """Recarga el bucket y consume un token. Devuelve (tokens, segundos de espera; 0 = permitido)."""
+    if updated == 0:
+        tokens = burst
+    else:
+        # monotonic() vuelve a empezar tras reiniciar la máquina: sin el max() un
+        # `updated` antiguo daría tiempo negativo y dejaría la clave bloqueada.
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class TokenBucket:
+    """Token bucket en memoria del worker."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = 0.0
+        self.updated = 0.0
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens, retry_after = take_token(self.tokens, self.updated, now, self.rate, self.burst)
+        self.updated = now
+        return retry_after
+
+
+class SharedTokenBucket:
+    """Token bucket guardado en un archivo mapeado compartido por todos los workers.
+
+    Cada clave ocupa un slot fijo protegido con `lockf` sobre su rango de bytes,
+    así que dos claves distintas nunca compiten por el mismo bloqueo.
+    """
+
+    def __init__(self, fd, mm, slot, rate, burst):
+        self.fd = fd
+        self.mm = mm
+        self.offset = slot * SLOT.size
+        self.rate = rate
+        self.burst = burst
+
+    def take(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT.size, self.offset)
+        try:
+            now = time.monotonic()
+            tokens, updated = SLOT.unpack_from(self.mm, self.offset)
+            tokens, retry_after = take_token(tokens, updated, now, self.rate, self.burst)
+            SLOT.pack_into(self.mm, self.offset, tokens, now)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT.size, self.offset)
+        return retry_after
+
+
+class ApiClient:
+    """Una clave válida: identificador no secreto (para logs/métricas) y su limitador."""
+
+    def __init__(self, digest, limiter):
+        self.digest = digest
+        self.id = digest.hex()[:8]
+        self.limiter = limiter
+
+
+class ApiKeyStore:
+    def __init__(self, digests, rate=0, burst=0, shared_path=None):
+        limiters = self._limiters(digests, rate, burst, shared_path)
+        self._clients = {digest: ApiClient(digest, limiter) for digest, limiter in zip(digests, limiters)}
+
+    @staticmethod
+    def _limiters(digests, rate, burst, shared_path):
+        count = len(digests)
+        if rate <= 0:
+            return [None] * count
+        burst = max(burst, 1)
+        if not shared_path or fcntl is None or count == 0:
+            return [TokenBucket(rate, burst) for _ in range(count)]
+        # El primer slot es la cabecera con shared_run_id(); los buckets van detrás.
+        size = (count + 1) * SLOT.size
+        run_id = shared_run_id(digests)
+        fd = os.open(shared_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            # Solo crece: encogerlo mataría con SIGBUS a los workers que ya lo tienen mapeado.
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+            # Con otro arranque los tiempos monotonic guardados no valen, y con
+            # otras claves (u otro orden) los slots son de otra clave: a cero.
+            if mm[:SLOT.size] != run_id:
+                mm[SLOT.size:size] = bytes(size - SLOT.size)
+                mm[:SLOT.size] = run_id
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        return [SharedTokenBucket(fd, mm, slot, rate, burst) for slot in range(1, count + 1)]
+
+    def __bool__(self):
+        return bool(self._clients)
+
+    def lookup(self, key):
+        """Devuelve el ApiClient de `key`, o None si no es una clave válida."""
+        return self._clients.get(hash_api_key(key))
+
+
+def load_api_keys():
+    """Lee las claves del entorno una sola vez al arrancar.
+
+    PROXY_API_KEY (clave única, compatibilidad), PROXY_API_KEYS (varias, en
+    claro, separadas por comas) y PROXY_API_KEY_HASHES (SHA-256 en hex). El
+    orden determina el slot de cada clave en el archivo de buckets compartido,
+    que se pone a cero si cambian las claves o la máquina se ha reiniciado.
+    """
+    digests = []
+    plain = [os.getenv("PROXY_API_KEY", "")] + os.getenv("PROXY_API_KEYS", "").split(",")
+    digests += [hash_api_key(key.strip()) for key in plain if key.strip()]
+    digests += [bytes.fromhex(h.strip()) for h in os.getenv("PROXY_API_KEY_HASHES", "").split(",") if h.strip()]
+    return ApiKeyStore(
+        list(dict.fromkeys(digests)),
+        rate=float(os.getenv("RATE_LIMIT_PER_SECOND", "0")),
+        burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+        shared_path=os.getenv("RATE_LIMIT_SHARED_PATH"),
+    )
+
+
+if __name__ == "__main__":
+    for key in sys.argv[1:]:
+        print(hash_api_key(key).hex())
@@ -0,0 +1,534 @@
+"""Benchmarks en proceso del servidor de credenciales.
+
+Uso:
+    python benchmark.py creds [--requests N] [--concurrency C]
+    python benchmark.py stress [--writes N] [--readers R] [--legacy]
+    python benchmark.py replay [--file grabadas.jsonl] [--scenarios a,b] [--concurrency 1,10,50]
+                               [--workers 1,2] [--output r.json] [--compare base.json]
+    python benchmark.py startup [--imports N] [--workers W]
+
+Ejecuta la app ASGI directamente (sin red) sobre un oauth_creds.json de
+prueba en un directorio temporal, para que los números midan solo el
+código del servidor.
+
+`stress` reescribe las credenciales miles de veces mientras varios procesos
+las leen del archivo, del snapshot mmap y a través de CredentialCache, y termina con código 1 si alguna
+lectura obtiene un JSON a medias.
+
+`replay` mide p50/p99 y throughput de cada ruta (lectura por petición,
+cache, 304, pool, proxy JSON/SSE y refresco del token) con varios niveles
+de concurrencia y de procesos worker, contra `mock_upstream` en proceso.
+Con --file reproduce un JSONL de peticiones grabadas, una por línea:
+    {"method": "GET", "path": "/oauth_creds.json", "headers": {...}, "body": ...}
+Las líneas sin "method"/"path" se ignoran; un "status" opcional fija la
+respuesta esperada (por defecto, cualquier código < 400). Con --compare termina con
+código 1 si algún escenario empeora más de --tolerance respecto a una
+ejecución anterior guardada con --output.
+
+`startup` mide el tiempo de `import main` en un proceso nuevo y arranca
+gunicorn con gunicorn.conf.py (con y sin preload_app) para medir el tiempo
+hasta la primera respuesta y la memoria RSS/PSS de cada worker (Linux).
+"""
+import os
+import sys
+import io
+import json
+import time
+import asyncio
+import statistics
+import contextlib
+import argparse
+import queue
+import multiprocessing
+import socket
+import subprocess
+import tempfile
+import urllib.request
+from pathlib import Path
+
+BENCH_API_KEY = "bench-key"
+RESULT_TIMEOUT_SECONDS = 600 # Máximo que se espera a los procesos hijos antes de abortar
+SAMPLE_CREDS = {
+    "access_token": "a" * 86,
+    "token_type": "Bearer",
+    "refresh_token": "r" * 86,
+    "resource_url": "portal.qwen.ai",
+    "expiry_date": int(time.time()) + 3600,
+}
+
+
+def prepare_workdir():
+    """Crea un directorio temporal con credenciales de prueba y entra en él."""
+    workdir = Path(tempfile.mkdtemp(prefix="qwen-bench-"))
+    (workdir / "oauth_creds.json").write_text(json.dumps(SAMPLE_CREDS, indent=4))
+    (workdir / "creds_pool").mkdir()
+    for i in range(4):
+        (workdir / "creds_pool" / f"account{i}.json").write_text(json.dumps(SAMPLE_CREDS, indent=4))
+    os.chdir(workdir)
+    os.environ["PROXY_API_KEY"] = BENCH_API_KEY
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    return workdir
+
+
+def build_legacy_app():
+    """Reproduce el endpoint original: stat + lectura + json.loads + JSONResponse."""
+    from fastapi import Depends, FastAPI, HTTPException
+    from fastapi.responses import JSONResponse
+    import main
+
+    legacy = FastAPI()
+
+    @legacy.get("/oauth_creds.json", dependencies=[Depends(main.verify_api_key)])
+    def serve_credentials():
+        if main.CREDS_FILE.exists():
+            return JSONResponse(content=json.loads(main.CREDS_FILE.read_text()))
+        raise HTTPException(status_code=404)
+
+    return legacy
+
+
+async def run_concurrently(operation, total, concurrency):
+    """Ejecuta `operation(i)` `total` veces con `concurrency` tareas; devuelve (latencias, segundos, errores)."""
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            ok = await operation(index)
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+async def run_requests(app, recorded, total, concurrency):
+    """Reproduce en bucle las peticiones grabadas `recorded` contra `app` a través de ASGI."""
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def send(index):
+            request = recorded[index % len(recorded)]
+            body = request.get("body")
+            response = await client.request(
+                request["method"],
+                request["path"],
+                headers={"X-API-Key": BENCH_API_KEY, **request.get("headers", {})},
+                content=body if isinstance(body, (str, bytes)) else None,
+                json=body if isinstance(body, (dict, list)) else None,
+            )
+            if "status" in request:
+                return response.status_code == request["status"]
+            return response.status_code < 400
+
+        return await run_concurrently(send, total, concurrency)
+
+
+async def run_load(app, path, total, concurrency, headers=None):
+    """Lanza `total` GET contra `app` con `concurrency` clientes; devuelve req/s."""
+    recorded = [{"method": "GET", "path": path, "headers": headers or {}}]
+    latencies, elapsed, errors = await run_requests(app, recorded, total, concurrency)
+    if errors:
+        raise RuntimeError(f"{path}: {errors} respuestas con error")
+    return total / elapsed
+
+
+def bench_creds(args):
+    prepare_workdir()
+    import main
+
+    results = {
+        "legacy (lectura por petición)": asyncio.run(
+            run_load(build_legacy_app(), "/oauth_creds.json", args.requests, args.concurrency)
+        ),
+        "cache en memoria": asyncio.run(
+            run_load(main.app, "/oauth_creds.json", args.requests, args.concurrency)
+        ),
+    }
+    main.credential_cache.get()
+    results["cache + If-None-Match (304)"] = asyncio.run(
+        run_load(main.app, "/oauth_creds.json", args.requests, args.concurrency,
+                 headers={"If-None-Match": main.credential_cache.etag})
+    )
+    for name, rps in results.items():
+        print(f"{name:<32} {rps:>10.0f} req/s")
+
+
+def collect_results(processes, results, timeout=RESULT_TIMEOUT_SECONDS):
+    """Recoge un resultado por proceso de la cola `results` y espera a que terminen.
+
+    Si un proceso muere sin enviar su resultado o se agota `timeout`, termina
+    el resto y sale con error en lugar de bloquearse para siempre.
+    """
+    outcomes = []
+    deadline = time.monotonic() + timeout
+    while len(outcomes) < len(processes):
+        try:
+            outcomes.append(results.get(timeout=1))
+        except queue.Empty:
+            crashed = [p for p in processes if p.exitcode not in (None, 0)]
+            if crashed or time.monotonic() > deadline:
+                for process in processes:
+                    process.terminate()
+                codes = ", ".join(f"{p.pid}: {p.exitcode}" for p in processes)
+                reason = "terminaron con error" if crashed else f"no respondieron en {timeout:.0f}s"
+                sys.exit(f"Los procesos del benchmark {reason} (pid: código de salida -> {codes})")
+    for process in processes:
+        process.join()
+    return outcomes
+
+
+def stress_payloads(count=8):
+    """Credenciales de tamaños distintos, para que una lectura a medias no pueda pasar por válida."""
+    return [dict(SAMPLE_CREDS, access_token=f"{i}" * (40 + 120 * i)) for i in range(count)]
+
+
+def stress_reader(source, stop, results):
+    from cache import CredentialCache
+    from snapshot import CredentialSnapshot
+
+    valid = stress_payloads()
+    snapshot = CredentialSnapshot(os.environ["CREDS_SNAPSHOT_PATH"])
+    # Lo que usan los workers: la cache sobre el archivo, y sobre el snapshot con el archivo de respaldo.
+    cache = CredentialCache(Path("oauth_creds.json"), snapshot if source == "cache+snapshot" else None)
+    reads = torn = 0
+    while not stop.is_set():
+        if source == "snapshot":
+            generation, raw = snapshot.read()
+            if generation == 0:
+                continue
+        elif source.startswith("cache"):
+            raw = cache.get()
+        else:
+            raw = Path("oauth_creds.json").read_bytes()
+        reads += 1
+        try:
+            if json.loads(raw) not in valid:
+                torn += 1
+        except (TypeError, ValueError):
+            torn += 1 # incluye None: la cache no tenía ninguna versión válida
+    results.put((source, reads, torn))
+
+
+def bench_stress(args):
+    workdir = prepare_workdir()
+    os.environ["CREDS_SNAPSHOT_PATH"] = str(workdir / "creds.snapshot")
+    import refresher
+
+    payloads = stress_payloads()
+    # Sin snapshot al arrancar los lectores: la primera escritura lo publica y
+    # la cache pasa del archivo al snapshot en plena carga.
+    Path("oauth_creds.json").write_text(json.dumps(payloads[0], indent=4))
+    ctx = multiprocessing.get_context("fork")
+    stop, results = ctx.Event(), ctx.Queue()
+    sources = ["file", "snapshot", "cache", "cache+snapshot"] * args.readers
+    readers = [ctx.Process(target=stress_reader, args=(source, stop, results)) for source in sources]
+    for reader in readers:
+        reader.start()
+
+    start = time.perf_counter()
+    for i in range(args.writes):
+        creds = payloads[i % len(payloads)]
+        if args.legacy:
+            Path("oauth_creds.json").write_text(json.dumps(creds, indent=4))
+            refresher._snapshot.publish(json.dumps(creds, indent=4).encode("utf-8"))
+        else:
+            refresher.save_credentials_to_file(creds)
+    elapsed = time.perf_counter() - start
+    stop.set()
+
+    totals = {}
+    for source, reads, torn in collect_results(readers, results):
+        prev_reads, prev_torn = totals.get(source, (0, 0))
+        totals[source] = (prev_reads + reads, prev_torn + torn)
+
+    writer = "Path.write_text" if args.legacy else "save_credentials_to_file"
+    print(f"{args.writes} escrituras con {writer} en {elapsed:.2f}s")
+    for source, (reads, torn) in totals.items():
+        print(f"{source:<15} {reads:>10} lecturas {torn:>8} corruptas")
+    if not args.legacy and any(torn for _, torn in totals.values()):
+        sys.exit(1)
+
+
+CHAT_REQUEST = {
+    "method": "POST",
+    "path": "/v1/chat/completions",
+    "body": {"model": "qwen3-coder-plus", "messages": [{"role": "user", "content": "hola"}]},
+}
+
+
+def default_scenarios():
+    """Peticiones de cada escenario y el código esperado; `refresh` no pasa por HTTP sino por
+    refresher.refresh_token_async. El ETag de `cache-304` se añade en run_scenario."""
+    creds = {"method": "GET", "path": "/oauth_creds.json", "status": 200}
+    chat = dict(CHAT_REQUEST, status=200)
+    return {
+        "legacy": [creds],
+        "cache": [creds],
+        "cache-304": [dict(creds, status=304)],
+        "pool": [{"method": "GET", "path": "/pool/oauth_creds.json", "status": 200}],
+        "proxy": [chat],
+        "proxy-stream": [dict(chat, body=dict(CHAT_REQUEST["body"], stream=True))],
+        "refresh": [],
+    }
+
+
+def load_recorded(path):
+    """Lee un JSONL de peticiones grabadas, ignorando las líneas que no lo son."""
+    recorded, skipped = [], 0
+    for line in Path(path).read_text().splitlines():
+        entry = json.loads(line) if line.strip() else {}
+        if "method" in entry and "path" in entry:
+            recorded.append(entry)
+        elif line.strip():
+            skipped += 1
+    if skipped:
+        print(f"{path}: {skipped} líneas sin method/path ignoradas")
+    return recorded
+
+
+async def run_scenario(name, recorded, total, concurrency):
+    import httpx
+    import main
+    import proxy
+    import refresher
+    import mock_upstream
+
+    upstream = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_upstream.app))
+    proxy._client = upstream
+    try:
+        if name == "refresh":
+            async def refresh(index):
+                await refresher.refresh_token_async(upstream)
+                return True
+
+            # Una sola redirección para todo el escenario: por tarea, las tareas
+            # concurrentes restaurarían stdout en desorden.
+            with contextlib.redirect_stdout(io.StringIO()):
+                return await run_concurrently(refresh, total, concurrency)
+        if name == "cache-304":
+            # ETag vigente al ejecutar: un escenario `refresh` anterior rota las credenciales.
+            main.credential_cache.get()
+            recorded = [dict(request, headers={"If-None-Match": main.credential_cache.etag}) for request in recorded]
+        app = build_legacy_app() if name == "legacy" else main.app
+        return await run_requests(app, recorded, total, concurrency)
+    finally:
+        await proxy.close_client()
+
+
+def replay_process(name, recorded, total, concurrency, results):
+    results.put(asyncio.run(run_scenario(name, recorded, total, concurrency)))
+
+
+def measure(name, recorded, total, concurrency, workers):
+    """Reparte la carga entre `workers` procesos y agrega sus latencias."""
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    share, per_worker = -(-total // workers), -(-concurrency // workers)
+    processes = [ctx.Process(target=replay_process, args=(name, recorded, share, per_worker, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    outcomes = collect_results(processes, results)
+
+    latencies = [latency for outcome in outcomes for latency in outcome[0]]
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p99 = cuts[49], cuts[98]
+    else:
+        p50 = p99 = latencies[0] if latencies else 0.0
+    return {
+        "scenario": name,
+        "workers": workers,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(outcome[2] for outcome in outcomes),
+        "rps": len(latencies) / (max(outcome[1] for outcome in outcomes) or 1),
+        "p50_ms": p50 * 1000,
+        "p99_ms": p99 * 1000,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    key = lambda r: (r["scenario"], r["workers"], r["concurrency"])
+    previous = {key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        if result["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{key(result)}: {before['rps']:.0f} -> {result['rps']:.0f} req/s")
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{key(result)}: p99 {before['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms")
+    return regressions
+
+
+def bench_replay(args):
+    # Las rutas del usuario son relativas al directorio actual, no al temporal.
+    for option in ("file", "output", "compare"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    prepare_workdir()
+    import main  # una sola vez, antes de los fork de measure()
+
+    scenarios = default_scenarios()
+    if args.file:
+        recorded = load_recorded(args.file)
+        if not recorded:
+            sys.exit(f"{args.file} no contiene peticiones grabadas.")
+        scenarios = {"replay": recorded, **scenarios}
+    names = args.scenarios.split(",") if args.scenarios else (["replay"] if args.file else list(scenarios))
+    unknown = set(names) - set(scenarios)
+    if unknown:
+        sys.exit(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    results = []
+    print(f"{'escenario':<14} {'workers':>7} {'conc':>5} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errores':>8}")
+    for name in names:
+        for workers in map(int, args.workers.split(",")):
+            for concurrency in map(int, args.concurrency.split(",")):
+                result = measure(name, scenarios[name], args.total, concurrency, workers)
+                results.append(result)
+                print(f"{name:<14} {workers:>7} {concurrency:>5} {result['rps']:>10.0f} "
+                      f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['errors']:>8}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = find_regressions(results, json.loads(Path(args.compare).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+        if regressions:
+            sys.exit(1)
+    if any(result["errors"] for result in results):
+        sys.exit(1)
+
+
+REPO_DIR = Path(__file__).resolve().parent
+
+
+def server_env(**extra):
+    """Entorno de producción, con las métricas multiproceso en el directorio de trabajo."""
+    metrics_dir = Path("prometheus_multiproc").resolve()
+    metrics_dir.mkdir(exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=str(REPO_DIR), APP_ENV="production", EMBEDDED_REFRESHER="0",
+               PROMETHEUS_MULTIPROC_DIR=str(metrics_dir))
+    env.update(extra)
+    return env
+
+
+def worker_memory(pid):
+    """(RSS, PSS) en MiB de un proceso, a partir de /proc/<pid>/smaps_rollup."""
+    values = {}
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+        name, _, rest = line.partition(":")
+        if name in ("Rss", "Pss"):
+            values[name] = int(rest.split()[0]) / 1024
+    return values["Rss"], values["Pss"]
+
+
+def child_pids(parent):
+    children = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            children.append(int(stat.parent.name))
+    return children
+
+
+def measure_gunicorn(workers, preload):
+    """Arranca gunicorn y devuelve (segundos hasta responder, [(rss, pss)] por worker)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, "-m", "gunicorn", "-c", str(REPO_DIR / "gunicorn.conf.py"),
+               "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "main:app"]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env=server_env(GUNICORN_PRELOAD="1" if preload else "0"),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = None
+        while ready is None:
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn terminó durante el arranque")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+                ready = time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        while len(child_pids(server.pid)) < workers:
+            time.sleep(0.05)
+        time.sleep(1)
+        return ready, [worker_memory(pid) for pid in child_pids(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_startup(args):
+    prepare_workdir()
+    timings = []
+    for _ in range(args.imports):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], env=server_env(), check=True)
+        timings.append(time.perf_counter() - start)
+    print(f"python -c 'import main': mediana {statistics.median(timings) * 1000:.0f} ms ({args.imports} ejecuciones)")
+
+    for preload in (False, True):
+        ready, memory = measure_gunicorn(args.workers, preload)
+        rss = statistics.mean(m[0] for m in memory)
+        pss = statistics.mean(m[1] for m in memory)
+        label = "preload_app" if preload else "sin preload"
+        print(f"gunicorn {args.workers} workers, {label:<12} primera respuesta {ready * 1000:>6.0f} ms, "
+              f"por worker RSS {rss:.1f} MiB, PSS {pss:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    creds = sub.add_parser("creds", help="GET /oauth_creds.json: ruta original vs cache")
+    creds.add_argument("--requests", type=int, default=5000)
+    creds.add_argument("--concurrency", type=int, default=50)
+    creds.set_defaults(func=bench_creds)
+
+    stress = sub.add_parser("stress", help="lecturas concurrentes durante miles de reescrituras")
+    stress.add_argument("--writes", type=int, default=5000)
+    stress.add_argument("--readers", type=int, default=2, help="procesos lectores por fuente")
+    stress.add_argument("--legacy", action="store_true", help="escribe con Path.write_text, sin atomicidad")
+    stress.set_defaults(func=bench_stress)
+
+    replay = sub.add_parser("replay", help="p50/p99 y throughput por escenario, concurrencia y workers")
+    replay.add_argument("--file", help="JSONL de peticiones grabadas")
+    replay.add_argument("--scenarios", help="lista separada por comas (por defecto todos)")
+    replay.add_argument("--total", type=int, default=2000, help="peticiones por medición")
+    replay.add_argument("--concurrency", default="1,10,50")
+    replay.add_argument("--workers", default="1,2")
+    replay.add_argument("--output", help="guarda los resultados en JSON")
+    replay.add_argument("--compare", help="resultados JSON de referencia")
+    replay.add_argument("--tolerance", type=float, default=0.2)
+    replay.set_defaults(func=bench_replay)
+
+    startup = sub.add_parser("startup", help="tiempo de arranque y memoria por worker")
+    startup.add_argument("--imports", type=int, default=5, help="repeticiones de 'import main'")
+    startup.add_argument("--workers", type=int, default=4)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+from refresher import expiry_timestamp
+
+
+class CredentialCache:
+    """Respuesta ya serializada de las credenciales, recargada solo cuando cambia el archivo.
+
+    Cada worker de gunicorn tiene su propia instancia. Por petición solo se hace
+    un ``stat``; el archivo se vuelve a leer y parsear únicamente cuando cambian
+    su inodo, mtime o tamaño (el refresher lo reescribe una vez por ciclo).
+
+    Con un `snapshot` (CredentialSnapshot) publicado, la comprobación es solo
+    leer su contador de generación en memoria compartida, sin tocar el disco.
+    """
+
+    def __init__(self, path, snapshot=None):
+        self.path = path
+        self.snapshot = snapshot
+        self.body = None
+        self.etag = None
+        self.creds = None
+        self.expiry = 0
+        self.error = None
+        self._signature = None
+
+    def get(self):
+        """Devuelve los bytes JSON actuales, o None si el archivo no existe o no es JSON válido (ver `error`)."""
+        if self.snapshot is not None:
+            generation = self.snapshot.generation()
+            if generation and ("snapshot", generation) == self._signature:
+                return self.body
+            if generation:
+                generation, data = self.snapshot.read()
+                if data is not None:
+                    self._load(data, ("snapshot", generation))
+                    return self.body
+            # Snapshot vacío o atascado a mitad de publicación: se usa el archivo.
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.body = self.etag = self.creds = self._signature = self.error = None
+            self.expiry = 0
+            return None
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature != self._signature:
+            self._load(self.path.read_bytes(), signature)
+        return self.body
+
+    def _load(self, raw, signature):
+        try:
+            creds = json.loads(raw)
+            if not isinstance(creds, dict):
+                raise ValueError("se esperaba un objeto JSON")
+        except ValueError as e:
+            # Lectura a medio escribir o archivo corrupto: se sigue sirviendo la
+            # versión anterior (si la hay) y se reintenta en la próxima petición.
+            self.error = f"{self.path.name}: credenciales inválidas ({e})"
+            return
+        self.body = json.dumps(creds, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = '"%s"' % hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self.creds = creds
+        self.expiry = expiry_timestamp(creds)
+        self.error = None
+        self._signature = signature
+
+
+def etag_matches(if_none_match, etag):
+    """Compara una cabecera If-None-Match (lista, `*` o ETags débiles) con el ETag actual."""
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
@@ -0,0 +1,50 @@
+import os
+import glob
+
+# Configuración leída automáticamente por gunicorn desde el directorio de trabajo.
+# Todos los valores se pueden sobrescribir con variables de entorno.
+
+def available_cpus():
+    """CPUs utilizables por el contenedor: afinidad y, si existe, la cuota de cgroup v2."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+# El servidor es asíncrono y casi todo su trabajo es E/S: un worker por CPU basta.
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or available_cpus()
+# Usa uvloop y httptools automáticamente cuando están instalados (requirements.txt).
+worker_class = "uvicorn.workers.UvicornWorker"
+# Importa la app una vez en el maestro: los workers arrancan con fork y comparten páginas.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# Mayor que el idle timeout típico de los balanceadores (60 s) para no cortar conexiones reutilizables.
+keepalive = int(os.getenv("KEEPALIVE_SECONDS", "75"))
+backlog = int(os.getenv("BACKLOG", "2048"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# El heartbeat de los workers en tmpfs evita bloqueos por disco lento en contenedores.
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+def reset_multiproc_dir():
+    """Crea el directorio de métricas y borra las de una ejecución anterior.
+
+    Se ejecuta al cargar esta configuración, antes de que el maestro importe
+    la app con preload_app: en on_starting ya existirían los .db del maestro.
+    """
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+
+reset_multiproc_dir()
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,89 @@
+import os
+import math
+import mmap
+import time
+import struct
+
+try:
+    import fcntl
+except ImportError:  # Windows: estado solo en memoria del proceso
+    fcntl = None
+
+# Estado de una cuenta: fin del cooldown (epoch), fallos informados por clientes
+# y refrescos fallidos consecutivos.
+STATE = struct.Struct("<dQQ")
+
+
+class AccountHealth:
+    """Salud de una cuenta del pool compartida por todos los procesos.
+
+    Se guarda en un archivo `<cuenta>.json.state` mapeado en memoria junto a las
+    credenciales; cada actualización se hace bajo `lockf`, así que el cooldown
+    que pone un worker lo ven los demás y el refresher.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._mm = None
+        self._local = [0.0, 0, 0]
+
+    def _open(self):
+        if self._mm is not None or fcntl is None:
+            return self._mm is not None
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return False
+        if os.fstat(fd).st_size < STATE.size:
+            os.ftruncate(fd, STATE.size)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, STATE.size)
+        return True
+
+    def read(self):
+        """Devuelve (cooldown_until, failures, refresh_failures)."""
+        if not self._open():
+            return tuple(self._local)
+        cooldown_until, failures, refresh_failures = STATE.unpack_from(self._mm, 0)
+        if not math.isfinite(cooldown_until):
+            cooldown_until = 0.0 # archivo escrito antes de validar `seconds`
+        return cooldown_until, failures, refresh_failures
+
+    def _update(self, change):
+        if not self._open():
+            self._local = list(change(*self._local))
+            return
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, STATE.size, 0)
+        try:
+            STATE.pack_into(self._mm, 0, *change(*STATE.unpack_from(self._mm, 0)))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, STATE.size, 0)
+
+    def cooldown(self, seconds):
+        """Registra un fallo informado por un cliente y aparta la cuenta `seconds` segundos."""
+        if not math.isfinite(seconds) or seconds < 0:
+            raise ValueError(f"Cooldown inválido: {seconds}")
+        until = time.time() + seconds
+        self._update(lambda cooldown_until, failures, refresh_failures:
+                     (max(cooldown_until, until) if math.isfinite(cooldown_until) else until,
+                      failures + 1, refresh_failures))
+
+    def refresh_failed(self):
+        self._update(lambda cooldown_until, failures, refresh_failures:
+                     (cooldown_until, failures, refresh_failures + 1))
+
+    def refresh_succeeded(self):
+        self._update(lambda cooldown_until, failures, refresh_failures:
+                     (cooldown_until, failures, 0))
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            os.close(self._fd)
+            self._mm = self._fd = None
+
+
+def health_path(path):
+    """Archivo de estado de la cuenta cuyas credenciales están en `path`."""
+    return path.with_name(path.name + ".state")
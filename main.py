@@ -1,30 +1,171 @@
 import os
-import json
+import math
+import time
+import asyncio
+import contextlib
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, Request, Response
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+import auth
+import proxy
+import metrics
+import refresher
+from cache import CredentialCache, etag_matches
+from pool import CredentialPool, POOL_COOLDOWN_SECONDS, POOL_MAX_COOLDOWN_SECONDS
+from snapshot import CredentialSnapshot, SNAPSHOT_PATH
 
 load_dotenv()
-app = FastAPI()
 
 CREDS_FILE = Path("oauth_creds.json")
-PROXY_API_KEY = os.getenv("PROXY_API_KEY")
+API_KEYS = auth.load_api_keys()
+LONG_POLL_MAX_SECONDS = float(os.getenv("LONG_POLL_MAX_SECONDS", "300"))
+LONG_POLL_INTERVAL_SECONDS = float(os.getenv("LONG_POLL_INTERVAL_SECONDS", "0.5"))
+PRODUCTION = os.getenv("APP_ENV") == "production"
+EMBEDDED_REFRESHER = os.getenv("EMBEDDED_REFRESHER", "1") == "1"
+PROXY_USE_POOL = os.getenv("PROXY_USE_POOL", "0") == "1"
 
-async def verify_api_key(x_api_key: str = Header(None)):
-    if PROXY_API_KEY is None:
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Arranca el refresher dentro de cada worker; el bloqueo de archivo deja refrescar solo a uno."""
+    tasks = []
+    if EMBEDDED_REFRESHER:
+        if refresher.initialize_credentials():
+            tasks.append(asyncio.create_task(refresher.run_scheduler()))
+        if refresher.CREDS_POOL_DIR.is_dir():
+            tasks.append(asyncio.create_task(refresher.run_pool_scheduler(refresher.CREDS_POOL_DIR)))
+    yield
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await proxy.close_client()
+
+
+# En producción no se generan /docs ni el esquema OpenAPI.
+docs = {"docs_url": None, "redoc_url": None, "openapi_url": None} if PRODUCTION else {}
+app = FastAPI(lifespan=lifespan, **docs)
+app.add_middleware(metrics.MetricsMiddleware)
+
+credential_cache = CredentialCache(CREDS_FILE, CredentialSnapshot(SNAPSHOT_PATH) if SNAPSHOT_PATH else None)
+credential_pool = CredentialPool(refresher.CREDS_POOL_DIR)
+
+
+def credentials_response(if_none_match=None):
+    """Construye la respuesta 200/304 a partir de la cache, con ETag y Cache-Control."""
+    body = credential_cache.get()
+    if body is None and credential_cache.error:
+        raise HTTPException(status_code=503, detail="El archivo de credenciales no es JSON válido.")
+    if body is None:
+        metrics.CREDENTIALS_NOT_FOUND.inc()
+        raise HTTPException(status_code=404, detail="El archivo de credenciales aún no ha sido generado por el worker.")
+    remaining = int(credential_cache.expiry - time.time())
+    headers = {
+        "ETag": credential_cache.etag,
+        "Cache-Control": f"private, max-age={remaining}" if remaining > 0 else "private, no-cache",
+    }
+    if etag_matches(if_none_match, credential_cache.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def verify_api_key(request: Request):
+    # Las cabeceras se leen directamente de la petición, sin validación de parámetros de FastAPI.
+    x_api_key = request.headers.get("x-api-key")
+    authorization = request.headers.get("authorization")
+    if not API_KEYS:
         raise HTTPException(status_code=500, detail="El servidor no tiene una PROXY_API_KEY configurada.")
-    if x_api_key is None or x_api_key != PROXY_API_KEY:
+    # Los clientes OpenAI envían la clave como "Authorization: Bearer <clave>".
+    if x_api_key is None and authorization and authorization.startswith("Bearer "):
+        x_api_key = authorization[len("Bearer "):]
+    client = API_KEYS.lookup(x_api_key) if x_api_key is not None else None
+    if client is None:
+        metrics.AUTH_FAILURES.labels("missing" if x_api_key is None else "invalid").inc()
         raise HTTPException(status_code=401, detail="API Key del proxy inválida o no proporcionada.")
+    if client.limiter is not None:
+        retry_after = client.limiter.take()
+        if retry_after:
+            metrics.AUTH_FAILURES.labels("rate_limited").inc()
+            raise HTTPException(status_code=429, detail="Límite de peticiones excedido para esta API Key.",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
 
 @app.get("/")
 def health_check():
     return {"status": "ok", "message": "Qwen Credential Server is running!"}
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Métricas en formato Prometheus (agregadas entre workers con PROMETHEUS_MULTIPROC_DIR)."""
+    body, content_type = metrics.render(metrics.CredentialExpiryCollector(credential_cache, credential_pool))
+    return Response(content=body, media_type=content_type)
+
 @app.get("/oauth_creds.json", dependencies=[Depends(verify_api_key)])
-def serve_credentials():
+async def serve_credentials(request: Request):
     """Sirve el archivo de credenciales que el worker mantiene actualizado."""
-    if CREDS_FILE.exists():
-        return JSONResponse(content=json.loads(CREDS_FILE.read_text()))
+    return credentials_response(request.headers.get("if-none-match"))
+
+@app.get("/oauth_creds.json/wait", dependencies=[Depends(verify_api_key)])
+async def wait_for_rotation(if_none_match: str = Header(None), timeout: float = Query(60, ge=0)):
+    """Long-poll: mantiene la conexión abierta hasta que el refresher escribe un token nuevo.
+
+    El cliente envía el ETag que ya tiene en If-None-Match. Si las credenciales
+    cambian (o ya eran distintas) se devuelven con 200; si pasa `timeout` sin
+    cambios se responde 304 y el cliente vuelve a esperar.
+    """
+    deadline = time.monotonic() + min(timeout, LONG_POLL_MAX_SECONDS)
+    while credential_cache.get() is not None and etag_matches(if_none_match, credential_cache.etag):
+        if time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(LONG_POLL_INTERVAL_SECONDS)
+    return credentials_response(if_none_match)
+
+
+@app.get("/pool/oauth_creds.json", dependencies=[Depends(verify_api_key)])
+async def serve_pool_credentials():
+    """Entrega las credenciales de la siguiente cuenta disponible del pool (cabecera X-Account-Id)."""
+    account = credential_pool.acquire()
+    if account is None:
+        if not credential_pool.accounts:
+            raise HTTPException(status_code=404, detail="No hay cuentas en el pool de credenciales.")
+        retry_after = credential_pool.next_available_in()
+        raise HTTPException(status_code=503, detail="Todas las cuentas del pool están en cooldown o expiradas.",
+                            headers={"Retry-After": str(retry_after)})
+    return Response(content=account.cache.body, media_type="application/json",
+                    headers={"X-Account-Id": account.id, "Cache-Control": "no-store"})
+
+@app.post("/pool/accounts/{account_id}/cooldown", dependencies=[Depends(verify_api_key)])
+async def cooldown_pool_account(account_id: str, seconds: float = Query(POOL_COOLDOWN_SECONDS, ge=0, le=POOL_MAX_COOLDOWN_SECONDS)):
+    """Permite al cliente informar de un límite de tasa: la cuenta deja de repartirse durante `seconds`."""
+    if not credential_pool.report_failure(account_id, seconds):
+        raise HTTPException(status_code=404, detail="Cuenta no encontrada en el pool.")
+    return {"status": "ok", "account": account_id, "cooldown_seconds": seconds}
+
+@app.get("/pool/accounts", dependencies=[Depends(verify_api_key)])
+async def pool_status():
+    """Estado de salud de cada cuenta del pool (cooldown y fallos compartidos entre workers)."""
+    return JSONResponse(content=credential_pool.status())
+
+
+@app.api_route("/v1/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"], dependencies=[Depends(verify_api_key)])
+async def proxy_qwen_api(path: str, request: Request):
+    """Proxy inverso autenticado hacia el API de Qwen (compatible con OpenAI).
+
+    Inyecta el access token vigente, de modo que los clientes nunca lo ven.
+    Con PROXY_USE_POOL=1 usa una cuenta del pool y la pone en cooldown si el
+    upstream responde 429.
+    """
+    account = None
+    if PROXY_USE_POOL:
+        account = credential_pool.acquire()
+        if account is None:
+            raise HTTPException(status_code=503, detail="No hay cuentas disponibles en el pool.",
+                                headers={"Retry-After": str(credential_pool.next_available_in())})
+        creds = account.cache.creds
     else:
-        raise HTTPException(status_code=404, detail="El archivo de credenciales aún no ha sido generado por el worker.")
\ No newline at end of file
+        if credential_cache.get() is None:
+            raise HTTPException(status_code=503, detail="El archivo de credenciales aún no ha sido generado por el worker.")
+        creds = credential_cache.creds
+    response = await proxy.forward(request, path, creds)
+    if account is not None and response.status_code == 429:
+        credential_pool.report_failure(account.id)
+    return response
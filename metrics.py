@@ -0,0 +1,100 @@
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Con PROMETHEUS_MULTIPROC_DIR definido, cada proceso (workers de gunicorn y
+# refresher) escribe sus métricas en ese directorio y /metrics las agrega.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUESTS = Counter(
+    "qwen_http_requests_total", "Peticiones HTTP atendidas.", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "qwen_http_request_duration_seconds", "Latencia de las peticiones HTTP.", ["method", "route"],
+    buckets=LATENCY_BUCKETS)
+AUTH_FAILURES = Counter(
+    "qwen_auth_failures_total", "Peticiones rechazadas por verify_api_key (401/429).", ["reason"])
+CREDENTIALS_NOT_FOUND = Counter(
+    "qwen_credentials_not_found_total", "Peticiones de credenciales sin archivo disponible (404).")
+REFRESH_DURATION = Histogram(
+    "qwen_token_refresh_duration_seconds", "Duración de los refrescos de token correctos.", ["account"],
+    buckets=LATENCY_BUCKETS)
+REFRESH_FAILURES = Counter(
+    "qwen_token_refresh_failures_total", "Refrescos de token fallidos.", ["account"])
+LAST_REFRESH_SUCCESS = Gauge(
+    "qwen_token_last_refresh_success_timestamp_seconds", "Momento del último refresco correcto.", ["account"],
+    multiprocess_mode="max")
+
+
+class CredentialExpiryCollector:
+    """Segundos hasta la expiración de cada token, calculados en el momento del scrape.
+
+    Se lee de las caches del worker que atiende /metrics, así que no depende
+    de qué proceso hizo el último refresco.
+    """
+
+    def __init__(self, cache, pool):
+        self.cache = cache
+        self.pool = pool
+
+    def collect(self):
+        now = time.time()
+        family = GaugeMetricFamily(
+            "qwen_token_expires_in_seconds", "Segundos hasta que expira el access token.", labels=["account"])
+        if self.cache.get() is not None:
+            family.add_metric([self.cache.path.stem], self.cache.expiry - now)
+        for status in self.pool.status():
+            account = self.pool.accounts[status["id"]]
+            if account.cache.body is not None:
+                family.add_metric([account.id], account.cache.expiry - now)
+        yield family
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro: cuenta y mide cada petición HTTP por ruta (plantilla, no URL)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.labels(scope["method"], path, str(status)).inc()
+            HTTP_LATENCY.labels(scope["method"], path).observe(time.perf_counter() - start)
+
+
+def render(*collectors):
+    """Devuelve (cuerpo, content-type) con todas las métricas, agregadas entre procesos si procede."""
+    registry = CollectorRegistry()
+    if MULTIPROCESS:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(_DefaultRegistry())
+    for collector in collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class _DefaultRegistry:
+    """Expone el registro global sin registrar los colectores extra en él."""
+
+    def collect(self):
+        return REGISTRY.collect()
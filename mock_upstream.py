@@ -0,0 +1,56 @@
+"""Upstream de Qwen simulado para desarrollo, benchmarks y pruebas del proxy.
+
+    uvicorn mock_upstream:app --port 9000
+    QWEN_API_BASE=http://127.0.0.1:9000/v1 QWEN_TOKEN_REFRESH_URL=http://127.0.0.1:9000/oauth/token uvicorn main:app
+
+Implementa el endpoint OAuth de refresco y /v1/chat/completions (JSON o SSE
+con `"stream": true`). MOCK_STREAM_DELAY_SECONDS separa los trozos SSE.
+"""
+import os
+import json
+import time
+import asyncio
+import secrets
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_STREAM_DELAY_SECONDS = float(os.getenv("MOCK_STREAM_DELAY_SECONDS", "0"))
+MOCK_STREAM_CHUNKS = int(os.getenv("MOCK_STREAM_CHUNKS", "5"))
+
+app = FastAPI()
+
+
+@app.post("/oauth/token")
+async def token():
+    return {
+        "access_token": secrets.token_urlsafe(64),
+        "refresh_token": secrets.token_urlsafe(64),
+        "token_type": "Bearer",
+        "expires_in": 3600,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        return JSONResponse(status_code=401, content={"error": "missing token"})
+    body = await request.json()
+    created = int(time.time())
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model", "qwen3-coder-plus"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        }
+
+    async def events():
+        for i in range(MOCK_STREAM_CHUNKS):
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                     "choices": [{"index": 0, "delta": {"content": f"{i} "}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(MOCK_STREAM_DELAY_SECONDS)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,123 @@
+import os
+import math
+import time
+from cache import CredentialCache
+from health import AccountHealth, health_path
+
+POOL_STRATEGY = os.getenv("POOL_STRATEGY", "round_robin") # round_robin | lru
+POOL_COOLDOWN_SECONDS = float(os.getenv("POOL_COOLDOWN_SECONDS", "60"))
+POOL_MAX_COOLDOWN_SECONDS = float(os.getenv("POOL_MAX_COOLDOWN_SECONDS", "3600")) # Tope para el cooldown pedido por clientes
+
+
+class Account:
+    """Una cuenta del pool: su cache de credenciales y su estado de salud.
+
+    El cooldown y los contadores de fallos (de clientes y del refresher) son
+    compartidos entre procesos (AccountHealth); `served` y `last_used` son de
+    este worker.
+    """
+
+    def __init__(self, path):
+        self.id = path.stem
+        self.cache = CredentialCache(path)
+        self.health = AccountHealth(health_path(path))
+        self.last_used = 0.0
+        self.served = 0
+
+    @property
+    def cooldown_until(self):
+        return self.health.read()[0]
+
+    def available(self, now):
+        """Cuenta utilizable: archivo legible, token vigente y fuera de cooldown."""
+        return self.cache.get() is not None and self.cache.expiry > now and self.cooldown_until <= now
+
+    def status(self, now):
+        self.cache.get()
+        cooldown_until, failures, refresh_failures = self.health.read()
+        return {
+            "id": self.id,
+            "available": self.available(now),
+            "expires_in": max(0, int(self.cache.expiry - now)),
+            "cooldown_remaining": max(0, int(cooldown_until - now)),
+            "served": self.served,
+            "failures": failures,
+            "refresh_failures": refresh_failures,
+            "error": self.cache.error,
+        }
+
+
+class CredentialPool:
+    """Reparte tokens entre las cuentas de un directorio (`<cuenta>.json`).
+
+    El listado del directorio solo se vuelve a leer cuando cambia su mtime.
+    El cooldown se comparte entre los workers de gunicorn; el turno de
+    round_robin y los contadores de uso son locales a cada uno.
+    """
+
+    def __init__(self, directory, strategy=POOL_STRATEGY):
+        if strategy not in ("round_robin", "lru"):
+            raise ValueError(f"POOL_STRATEGY desconocida: {strategy}")
+        self.directory = directory
+        self.strategy = strategy
+        self.accounts = {}
+        self._order = []
+        self._next = 0
+        self._dir_mtime = None
+
+    def _scan(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            self.accounts, self._order, self._dir_mtime = {}, [], None
+            return
+        if mtime == self._dir_mtime:
+            return
+        paths = sorted(self.directory.glob("*.json"))
+        accounts = {p.stem: self.accounts.get(p.stem) or Account(p) for p in paths}
+        for account_id, account in self.accounts.items():
+            if account_id not in accounts:
+                account.health.close() # la cuenta ya no está en el directorio
+        self.accounts = accounts
+        self._order = list(self.accounts.values())
+        self._dir_mtime = mtime
+
+    def acquire(self):
+        """Devuelve la siguiente cuenta disponible según la estrategia, o None."""
+        self._scan()
+        now = time.time()
+        if self.strategy == "lru":
+            candidates = [a for a in self._order if a.available(now)]
+            account = min(candidates, key=lambda a: a.last_used, default=None)
+        else:
+            account = None
+            for offset in range(len(self._order)):
+                candidate = self._order[(self._next + offset) % len(self._order)]
+                if candidate.available(now):
+                    account = candidate
+                    self._next = (self._next + offset + 1) % len(self._order)
+                    break
+        if account is not None:
+            account.last_used = now
+            account.served += 1
+        return account
+
+    def report_failure(self, account_id, cooldown=POOL_COOLDOWN_SECONDS):
+        """Marca una cuenta en cooldown (p. ej. tras un 429 del upstream). Devuelve False si no existe."""
+        self._scan()
+        account = self.accounts.get(account_id)
+        if account is None:
+            return False
+        account.health.cooldown(cooldown)
+        return True
+
+    def next_available_in(self):
+        """Segundos hasta que termine el cooldown más corto (para Retry-After)."""
+        now = time.time()
+        pending = [a.cooldown_until - now for a in self._order if a.cooldown_until > now]
+        return max(1, math.ceil(min(pending, default=POOL_COOLDOWN_SECONDS)))
+
+    def status(self):
+        self._scan()
+        now = time.time()
+        return [account.status(now) for account in self._order]
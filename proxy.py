@@ -0,0 +1,74 @@
+import os
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+QWEN_API_BASE = os.getenv("QWEN_API_BASE") # p. ej. http://127.0.0.1:9000/v1 para un upstream simulado
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE = int(os.getenv("PROXY_MAX_KEEPALIVE", "20"))
+PROXY_READ_TIMEOUT = float(os.getenv("PROXY_READ_TIMEOUT", "300"))
+
+# Cabeceras que no deben reenviarse (RFC 9110 §7.6.1) o que pertenecen al propio proxy.
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+}
+REQUEST_EXCLUDED_HEADERS = HOP_BY_HOP_HEADERS | {"host", "authorization", "x-api-key"}
+
+_client = None
+
+
+def get_client():
+    """Cliente httpx compartido por todas las peticiones del worker (pool keep-alive)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=PROXY_MAX_CONNECTIONS, max_keepalive_connections=PROXY_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(30, read=PROXY_READ_TIMEOUT),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def upstream_url(creds, path):
+    base = QWEN_API_BASE or f"https://{creds.get('resource_url', 'portal.qwen.ai')}/v1"
+    return f"{base.rstrip('/')}/{path}"
+
+
+async def forward(request, path, creds):
+    """Reenvía `request` al API de Qwen con el token de `creds` y transmite la respuesta tal cual llega.
+
+    El cuerpo se pasa en streaming en ambos sentidos, de modo que las
+    respuestas SSE llegan al cliente trozo a trozo sin acumularse aquí.
+    """
+    headers = [(k, v) for k, v in request.headers.items() if k not in REQUEST_EXCLUDED_HEADERS]
+    headers.append(("authorization", f"{creds.get('token_type', 'Bearer')} {creds['access_token']}"))
+    # Sin cuerpo no se pasa el stream: httpx enviaría el GET/DELETE con
+    # Transfer-Encoding: chunked, que muchos upstreams y CDNs rechazan.
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    client = get_client()
+    upstream_request = client.build_request(
+        request.method,
+        upstream_url(creds, path),
+        params=request.query_params,
+        headers=headers,
+        content=request.stream() if has_body else None,
+    )
+    try:
+        upstream = await client.send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Error conectando con el API de Qwen: {e}")
+    response_headers = {k: v for k, v in upstream.headers.items() if k not in HOP_BY_HOP_HEADERS}
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers=response_headers,
+        background=BackgroundTask(upstream.aclose),
+    )
@@ -1,29 +1,88 @@
 import os
 import json
 import time
+import random
+import asyncio
+import tempfile
+import contextlib
+import httpx
 from pathlib import Path
-import requests
 from dotenv import load_dotenv
+from snapshot import CredentialSnapshot, SNAPSHOT_PATH
+from health import AccountHealth, health_path
+from metrics import LAST_REFRESH_SUCCESS, REFRESH_DURATION, REFRESH_FAILURES
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
 
 # Carga las mismas variables de entorno que la app principal
 load_dotenv()
 
 CREDS_FILE = Path("oauth_creds.json")
-QWEN_TOKEN_REFRESH_URL = "https://qwen.ai/oauth/token"
+CREDS_POOL_DIR = Path(os.getenv("CREDS_POOL_DIR", "creds_pool"))
+QWEN_TOKEN_REFRESH_URL = os.getenv("QWEN_TOKEN_REFRESH_URL", "https://qwen.ai/oauth/token")
 QWEN_CLIENT_ID = os.getenv("QWEN_CLIENT_ID", "dummy_client_id")
 QWEN_CLIENT_SECRET = os.getenv("QWEN_CLIENT_SECRET", "dummy_client_secret")
-REFRESH_INTERVAL_SECONDS = 3600 # Refrescar cada hora
+REFRESH_INTERVAL_SECONDS = int(os.getenv("REFRESH_INTERVAL_SECONDS", "3600")) # Máximo entre refrescos
+REFRESH_LIFETIME_FRACTION = float(os.getenv("REFRESH_LIFETIME_FRACTION", "0.8")) # Fracción de la vida restante a esperar
+REFRESH_RETRY_BASE_SECONDS = float(os.getenv("REFRESH_RETRY_BASE_SECONDS", "5"))
+REFRESH_RETRY_MAX_SECONDS = float(os.getenv("REFRESH_RETRY_MAX_SECONDS", "300"))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "30"))
 
-def load_credentials_from_file():
-    if CREDS_FILE.exists():
+def load_credentials_from_file(path=CREDS_FILE):
+    if path.exists():
         try:
-            return json.loads(CREDS_FILE.read_text())
+            return json.loads(path.read_text())
         except (json.JSONDecodeError, TypeError):
             return None
     return None
 
-def save_credentials_to_file(creds):
-    CREDS_FILE.write_text(json.dumps(creds, indent=4))
+def expiry_timestamp(creds):
+    """Devuelve `expiry_date` en segundos epoch (el CLI de Qwen lo guarda en milisegundos)."""
+    expiry = creds.get("expiry_date") or 0
+    if expiry > 10_000_000_000:
+        expiry /= 1000
+    return expiry
+
+_snapshot = CredentialSnapshot(SNAPSHOT_PATH, writable=True) if SNAPSHOT_PATH else None
+
+def save_credentials_to_file(creds, path=CREDS_FILE):
+    """Escritura atómica (temporal + fsync + os.replace): los lectores ven el archivo viejo o el nuevo, nunca uno a medias."""
+    data = json.dumps(creds, indent=4).encode("utf-8")
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    fsync_directory(path.parent)
+    if _snapshot is not None and path == CREDS_FILE:
+        _snapshot.publish(data)
+
+def publish_snapshot():
+    """Copia el archivo actual al snapshot compartido, p. ej. al asumir el liderazgo."""
+    if _snapshot is not None and CREDS_FILE.exists():
+        _snapshot.publish(CREDS_FILE.read_bytes())
+
+def fsync_directory(directory):
+    """Persiste la entrada de directorio tras os.replace (no disponible en Windows)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 def initialize_credentials():
     """Crea el archivo de credenciales desde el entorno si no existe."""
@@ -42,44 +101,184 @@ def initialize_credentials():
         print("Archivo de credenciales inicializado desde el entorno.")
     return True
 
-def refresh_token():
-    """Función principal del worker: carga, refresca y guarda el token."""
-    print("Worker: Iniciando ciclo de refresco...")
-    creds = load_credentials_from_file()
+def create_http_client():
+    """Cliente httpx con keep-alive, compartido por todos los ciclos de refresco."""
+    return httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_keepalive_connections=4))
+
+async def refresh_token_async(client, path=CREDS_FILE):
+    """Carga, refresca y guarda el token. Lanza excepción si el refresco falla.
+
+    La lectura y la escritura (con sus fsync) van a un hilo para no parar el
+    bucle de eventos del worker de gunicorn que también atiende peticiones.
+    """
+    print(f"Worker: Iniciando ciclo de refresco de {path.name}...")
+    creds = await asyncio.to_thread(load_credentials_from_file, path)
     if not creds:
-        print("Worker: No se encontraron credenciales para refrescar.")
-        return
+        print(f"Worker: No se encontraron credenciales para refrescar en {path.name}.")
+        return None
 
-    print("Worker: Refrescando token...")
+    print(f"Worker: Refrescando token de {path.name}...")
+    refresh_data = {
+        "grant_type": "refresh_token",
+        "refresh_token": creds["refresh_token"],
+    }
+    start = time.perf_counter()
     try:
-        refresh_data = {
-            "grant_type": "refresh_token",
-            "refresh_token": creds["refresh_token"],
-        }
-        response = requests.post(QWEN_TOKEN_REFRESH_URL, data=refresh_data, timeout=30)
+        response = await client.post(QWEN_TOKEN_REFRESH_URL, data=refresh_data)
         response.raise_for_status()
-        
         new_token_data = response.json()
-        new_expiry = int(time.time()) + new_token_data.get("expires_in", 3600)
-        
-        new_creds = {
-            "access_token": new_token_data["access_token"],
-            "refresh_token": new_token_data.get("refresh_token", creds["refresh_token"]),
-            "expiry_date": new_expiry,
-            "token_type": "Bearer",
-            "resource_url": "portal.qwen.ai"
-        }
-        save_credentials_to_file(new_creds)
-        print(f"Worker: Token refrescado exitosamente. Nueva expiración en {time.ctime(new_expiry)}")
+        access_token = new_token_data["access_token"]
+    except Exception:
+        REFRESH_FAILURES.labels(path.stem).inc()
+        raise
+    REFRESH_DURATION.labels(path.stem).observe(time.perf_counter() - start)
+
+    new_expiry = int(time.time()) + new_token_data.get("expires_in", 3600)
+
+    new_creds = {
+        "access_token": access_token,
+        "refresh_token": new_token_data.get("refresh_token", creds["refresh_token"]),
+        "expiry_date": new_expiry,
+        "token_type": "Bearer",
+        "resource_url": "portal.qwen.ai"
+    }
+    await asyncio.to_thread(save_credentials_to_file, new_creds, path)
+    LAST_REFRESH_SUCCESS.labels(path.stem).set(time.time())
+    print(f"Worker: {path.name}: Token refrescado exitosamente. Nueva expiración en {time.ctime(new_expiry)}")
+    return new_creds
+
+def refresh_token():
+    """Ejecuta un único ciclo de refresco de forma síncrona."""
+    async def refresh_once():
+        async with create_http_client() as client:
+            await refresh_token_async(client)
+
+    try:
+        asyncio.run(refresh_once())
     except Exception as e:
         print(f"Worker ERROR: No se pudo refrescar el token de Qwen. Error: {e}")
 
+def next_refresh_delay(creds):
+    """Segundos hasta el próximo refresco: una fracción de la vida restante del token."""
+    remaining = expiry_timestamp(creds) - time.time()
+    if remaining <= 0:
+        return 0
+    return min(remaining * REFRESH_LIFETIME_FRACTION, REFRESH_INTERVAL_SECONDS)
+
+def retry_delay(failures):
+    """Backoff exponencial con jitter tras `failures` fallos consecutivos."""
+    # El exponente se acota: con miles de fallos seguidos 2.0 ** n desbordaría un float.
+    delay = min(REFRESH_RETRY_BASE_SECONDS * 2 ** min(failures - 1, 32), REFRESH_RETRY_MAX_SECONDS)
+    return random.uniform(delay / 2, delay)
+
+class RefreshLock:
+    """Elección de líder entre procesos con `flock` no bloqueante sobre un archivo `.lock`.
+
+    El proceso que obtiene el bloqueo lo mantiene mientras vive; el kernel lo
+    libera si muere y otro worker toma el relevo en su siguiente intento.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+        self._fd = None
+
+async def schedule_refreshes(client, path=CREDS_FILE):
+    """Bucle de refresco de un archivo. Solo el proceso líder refresca; el resto espera su turno."""
+    lock = RefreshLock(path.with_name(path.name + ".lock"))
+    # Las cuentas del pool publican sus fallos de refresco en el estado de salud compartido.
+    health = AccountHealth(health_path(path)) if path != CREDS_FILE else None
+    failures = 0
+    leader = False
+    try:
+        while True:
+            if not lock.acquire():
+                await asyncio.sleep(LEADER_RETRY_SECONDS)
+                continue
+            if not leader:
+                leader = True
+                if path == CREDS_FILE:
+                    publish_snapshot()
+
+            creds = load_credentials_from_file(path)
+            if not creds:
+                print(f"Worker: Sin credenciales en {path.name}, reintentando en {LEADER_RETRY_SECONDS} segundos...")
+                await asyncio.sleep(LEADER_RETRY_SECONDS)
+                continue
+            # Tras un fallo se reintenta solo según el backoff, sin volver a esperar la vida del token.
+            delay = next_refresh_delay(creds) if failures == 0 else 0
+            if delay > 0:
+                print(f"Worker: {path.name}: Durmiendo durante {delay / 60:.1f} minutos...")
+                await asyncio.sleep(delay)
+                current = load_credentials_from_file(path)
+                if current and current.get("access_token") != creds.get("access_token"):
+                    # Otro proceso ya refrescó mientras dormíamos.
+                    continue
+
+            try:
+                await refresh_token_async(client, path)
+                failures = 0
+                if health is not None:
+                    health.refresh_succeeded()
+            except Exception as e:
+                failures += 1
+                if health is not None:
+                    health.refresh_failed()
+                delay = retry_delay(failures)
+                print(f"Worker ERROR: No se pudo refrescar el token de Qwen ({path.name}). Error: {e}. Reintento en {delay:.0f} segundos.")
+                await asyncio.sleep(delay)
+    finally:
+        lock.release()
+        if health is not None:
+            health.close()
+
+async def run_scheduler(client=None):
+    """Refresca CREDS_FILE indefinidamente."""
+    async with client or create_http_client() as client:
+        await schedule_refreshes(client)
+
+async def run_pool_scheduler(pool_dir, client=None):
+    """Refresca en paralelo cada cuenta (`*.json`) de `pool_dir`, detectando cuentas nuevas."""
+    tasks = {}
+    async with client or create_http_client() as client:
+        try:
+            while True:
+                for path in sorted(pool_dir.glob("*.json")):
+                    if path not in tasks:
+                        tasks[path] = asyncio.create_task(schedule_refreshes(client, path))
+                await asyncio.sleep(LEADER_RETRY_SECONDS)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
 if __name__ == "__main__":
     if not initialize_credentials():
         exit(1)
-        
-    # Bucle infinito para refrescar periódicamente
-    while True:
-        refresh_token()
-        print(f"Worker: Durmiendo durante {REFRESH_INTERVAL_SECONDS / 60} minutos...")
-        time.sleep(REFRESH_INTERVAL_SECONDS)
\ No newline at end of file
+
+    async def run_all():
+        schedulers = [run_scheduler()]
+        if CREDS_POOL_DIR.is_dir():
+            schedulers.append(run_pool_scheduler(CREDS_POOL_DIR))
+        await asyncio.gather(*schedulers)
+
+    asyncio.run(run_all())
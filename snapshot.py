@@ -0,0 +1,88 @@
+import os
+import mmap
+import struct
+
+SNAPSHOT_PATH = os.getenv("CREDS_SNAPSHOT_PATH") # p. ej. /dev/shm/qwen_creds.snapshot; sin definir = desactivado
+SNAPSHOT_SIZE = 64 * 1024
+# Intentos de lectura antes de dar el snapshot por atascado (escritor muerto a mitad de publicación).
+READ_ATTEMPTS = 1000
+
+# Cabecera: generación (u64) + longitud del payload (u32), rellenada a 16 bytes.
+HEADER = struct.Struct("<QI4x")
+GENERATION = struct.Struct("<Q")
+
+
+class CredentialSnapshot:
+    """Copia de las credenciales en un archivo mapeado en memoria, compartida entre procesos.
+
+    Protocolo seqlock: el escritor pone la generación en impar, copia el JSON y
+    la deja en par. Un lector que ve una generación impar, o distinta antes y
+    después de copiar, vuelve a intentarlo, así que nunca obtiene un JSON a
+    medias. Solo debe haber un escritor (el refresher líder).
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self._mm = None
+
+    def _open(self):
+        if self._mm is not None:
+            return True
+        flags = os.O_RDWR | os.O_CREAT if self.writable else os.O_RDONLY
+        try:
+            fd = os.open(self.path, flags, 0o600)
+        except FileNotFoundError:
+            return False
+        try:
+            if self.writable and os.fstat(fd).st_size < SNAPSHOT_SIZE:
+                os.ftruncate(fd, SNAPSHOT_SIZE)
+            if os.fstat(fd).st_size < SNAPSHOT_SIZE:
+                return False
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self._mm = mmap.mmap(fd, SNAPSHOT_SIZE, access=access)
+        finally:
+            os.close(fd)
+        return True
+
+    def generation(self):
+        """Generación actual (0 = todavía no publicado). Solo lee 8 bytes de memoria."""
+        if not self._open():
+            return 0
+        return GENERATION.unpack_from(self._mm, 0)[0]
+
+    def read(self):
+        """Devuelve (generación, bytes) de una copia consistente, o (0, None) si está vacío
+        o sigue a medio publicar tras READ_ATTEMPTS intentos."""
+        if not self._open():
+            return 0, None
+        mm = self._mm
+        for _ in range(READ_ATTEMPTS):
+            generation, length = HEADER.unpack_from(mm, 0)
+            if generation == 0:
+                return 0, None
+            if generation % 2:
+                continue
+            data = mm[HEADER.size:HEADER.size + length]
+            if GENERATION.unpack_from(mm, 0)[0] == generation:
+                return generation, data
+        return 0, None
+
+    def publish(self, data):
+        """Publica `data` como nueva versión de las credenciales."""
+        if len(data) > SNAPSHOT_SIZE - HEADER.size:
+            raise ValueError("Las credenciales no caben en el snapshot.")
+        self._open()
+        mm = self._mm
+        generation = GENERATION.unpack_from(mm, 0)[0]
+        if generation % 2:
+            generation += 1 # un escritor anterior murió a mitad de publicación
+        GENERATION.pack_into(mm, 0, generation + 1)
+        mm[HEADER.size:HEADER.size + len(data)] = data
+        HEADER.pack_into(mm, 0, generation + 1, len(data))
+        GENERATION.pack_into(mm, 0, generation + 2)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None